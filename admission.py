@@ -0,0 +1,156 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict
+
+# Admission limits (can be overridden through environment variables)
+USER_RATE_PER_SECOND = float(os.getenv("USER_RATE_PER_SECOND", "0.5"))  # Sustained requests per user
+USER_BURST = int(os.getenv("USER_BURST", "5"))  # Requests a single user may send in a burst
+GLOBAL_RATE_PER_SECOND = float(os.getenv("GLOBAL_RATE_PER_SECOND", "20"))  # Sustained requests for all users
+GLOBAL_BURST = int(os.getenv("GLOBAL_BURST", "40"))
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "8"))  # Concurrent LLM-backed requests
+MAX_QUEUED = int(os.getenv("MAX_QUEUED", "32"))  # Requests allowed to wait for a free slot
+QUEUE_RETRY_AFTER = float(os.getenv("QUEUE_RETRY_AFTER", "2"))  # Seconds suggested to clients when the queue is full
+MAX_TRACKED_USERS = 10000  # Number of per-user buckets kept in memory
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised when a request cannot be admitted. Carries the number of seconds
+    the client should wait before retrying.
+    """
+
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    """
+    Classic token bucket: refills at `rate` tokens per second up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """Returns how long to wait until `tokens` are available (0 if they are available now)."""
+        self._refill(time.monotonic())
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def consume(self, tokens: float = 1):
+        self.tokens -= tokens
+
+    @property
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class AdmissionController:
+    """
+    Admits requests through per-user and global token buckets, bounds the number
+    of concurrent calls and the queue in front of them, and coalesces duplicate
+    in-flight requests from the same user.
+    """
+
+    def __init__(self,
+                 user_rate: float = USER_RATE_PER_SECOND,
+                 user_burst: int = USER_BURST,
+                 global_rate: float = GLOBAL_RATE_PER_SECOND,
+                 global_burst: int = GLOBAL_BURST,
+                 max_in_flight: int = MAX_IN_FLIGHT,
+                 max_queued: int = MAX_QUEUED):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+
+        self._user_buckets = OrderedDict()
+        self._in_flight = {}  # (user_id, request key) -> asyncio.Task
+        self._semaphore = None  # Created lazily inside the running event loop
+        self._queued = 0
+
+    def _get_user_bucket(self, user_id: int) -> TokenBucket:
+        bucket = self._user_buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate, self.user_burst)
+            self._user_buckets[user_id] = bucket
+            # Forget idle users once too many are tracked (a full bucket carries no state)
+            while len(self._user_buckets) > MAX_TRACKED_USERS:
+                oldest_id = next(iter(self._user_buckets))
+                if oldest_id == user_id or not self._user_buckets[oldest_id].is_full:
+                    break
+                del self._user_buckets[oldest_id]
+        else:
+            self._user_buckets.move_to_end(user_id)
+        return bucket
+
+    def _check_rate(self, user_id: int):
+        """Consumes one token from the user's and the global bucket, or raises RateLimitExceeded."""
+        user_bucket = self._get_user_bucket(user_id)
+
+        user_wait = user_bucket.wait_time()
+        if user_wait > 0:
+            raise RateLimitExceeded("Too many requests, please slow down", user_wait)
+
+        global_wait = self.global_bucket.wait_time()
+        if global_wait > 0:
+            raise RateLimitExceeded("Service is busy, please try again later", global_wait)
+
+        user_bucket.consume()
+        self.global_bucket.consume()
+
+    async def _run_bounded(self, func, *args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        # Apply back-pressure instead of letting the queue grow without bound
+        if self._semaphore.locked() and self._queued >= self.max_queued:
+            raise RateLimitExceeded("Service is busy, please try again later", QUEUE_RETRY_AFTER)
+
+        self._queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._queued -= 1
+
+        try:
+            # Blocking work (LLM and database calls) runs outside the event loop
+            return await asyncio.to_thread(func, *args)
+        finally:
+            self._semaphore.release()
+
+    async def run(self, user_id: int, request_key: str, func, *args):
+        """
+        Runs `func(*args)` in a worker thread once the request is admitted.
+        A request identical to one already in flight for the same user shares its result.
+        """
+        coalesce_key = (user_id, request_key)
+        pending = self._in_flight.get(coalesce_key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        self._check_rate(user_id)
+
+        task = asyncio.ensure_future(self._run_bounded(func, *args))
+        self._in_flight[coalesce_key] = task
+        task.add_done_callback(lambda _: self._in_flight.pop(coalesce_key, None))
+
+        # Shield the shared task so a disconnecting client does not cancel it for the others
+        return await asyncio.shield(task)
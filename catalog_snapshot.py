@@ -0,0 +1,281 @@
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+from sqlalchemy.orm import Session, selectinload
+
+from catalog_sync import (catalog_version, content_hash, get_stored_catalog_version, record_from_cocktail,
+                          set_stored_catalog_version)
+from models_tools import CatalogMeta, Cocktail
+
+SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH", "data/catalog.snapshot")
+SNAPSHOT_MAGIC = b"MIXSNAP\x00"
+SNAPSHOT_VERSION = 2
+
+# Preamble: magic, format version, header length (little-endian)
+_PREAMBLE = struct.Struct("<8sII")
+_ALIGNMENT = 8
+
+# Cocktail attributes stored as string columns
+STRING_COLUMNS = ("name", "alcoholic", "category", "glass_type", "instruction", "drink_thumbnail")
+
+# Currently loaded snapshot of the running service
+_current_snapshot = None
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _file_id(stat) -> tuple:
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _encode_strings(values) -> dict:
+    """Encodes a list of optional strings as offsets + UTF-8 blob + null mask arrays."""
+    encoded = [value.encode("utf-8") if value is not None else b"" for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype="<i8")
+    offsets[1:] = np.cumsum([len(value) for value in encoded], dtype="<i8")
+    return {
+        "offsets": offsets,
+        "data": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        "nulls": np.array([value is None for value in values], dtype=np.uint8),
+    }
+
+
+class StringColumn:
+    """
+    Read-only view of an encoded string column. Values are decoded on access,
+    so opening a snapshot does not allocate Python strings.
+    """
+
+    def __init__(self, offsets, data, nulls):
+        self._offsets = offsets
+        self._data = data
+        self._nulls = nulls
+
+    def __len__(self):
+        return len(self._nulls)
+
+    def __getitem__(self, index: int):
+        if self._nulls[index]:
+            return None
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return self._data[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class CatalogSnapshot:
+    """
+    Memory-mapped catalog snapshot: cocktail columns, ingredient CSR arrays
+    (indptr/indices into the ingredient vocabulary) and the vocabulary itself.
+    All arrays are zero-copy views into the mapped file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.file_id = _file_id(os.fstat(f.fileno()))  # Identifies the file version that is mapped
+
+        magic, version, header_length = _PREAMBLE.unpack_from(self._mmap, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a catalog snapshot")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported catalog snapshot version {version} (expected {SNAPSHOT_VERSION})")
+
+        header = json.loads(bytes(self._mmap[_PREAMBLE.size:_PREAMBLE.size + header_length]))
+        self.catalog_version = header["catalog_version"]  # See catalog_sync.catalog_version
+        data_start = _align(_PREAMBLE.size + header_length)
+        self._sections = {
+            name: np.frombuffer(self._mmap, dtype=dtype, count=count, offset=data_start + offset)
+            if count else np.empty(0, dtype=dtype)
+            for name, (dtype, offset, count) in header["sections"].items()
+        }
+
+        self.ids = self._sections["id"]  # Sorted cocktail IDs
+        self.indptr = self._sections["ingredients.indptr"]
+        self.indices = self._sections["ingredients.indices"]
+        self.measures = self._string_column("measure")
+        self.vocabulary = self._string_column("vocabulary")
+        self.columns = {column: self._string_column(column) for column in STRING_COLUMNS}
+        self._name_index = None
+
+    def _string_column(self, name: str) -> StringColumn:
+        return StringColumn(self._sections[name + ".offsets"],
+                            self._sections[name + ".data"],
+                            self._sections[name + ".nulls"])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row_for_id(self, cocktail_id: int):
+        """Returns the row of a cocktail ID, or None if it is not in the snapshot."""
+        row = int(np.searchsorted(self.ids, cocktail_id))
+        return row if row < len(self.ids) and self.ids[row] == cocktail_id else None
+
+    def row_for_name(self, name: str):
+        """Returns the row of a cocktail name, or None. The name index is built on first use."""
+        if self._name_index is None:
+            self._name_index = {value: row for row, value in enumerate(self.columns["name"])}
+        return self._name_index.get(name)
+
+    def ingredient_ids(self, row: int):
+        """Vocabulary indices of the cocktail's ingredients (a view, in recipe order)."""
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    def ingredients(self, row: int) -> list:
+        return [self.vocabulary[i] for i in self.ingredient_ids(row)]
+
+    def cocktail(self, row: int) -> dict:
+        """Materializes one cocktail as a dictionary."""
+        start, end = self.indptr[row], self.indptr[row + 1]
+        record = {column: values[row] for column, values in self.columns.items()}
+        record["id"] = int(self.ids[row])
+        record["ingredients"] = [[self.vocabulary[self.indices[i]], self.measures[i]] for i in range(start, end)]
+        return record
+
+
+def write_snapshot(path: str, records: list) -> str:
+    """
+    Writes records (normalized cocktails with an "id", see catalog_sync.record_from_cocktail)
+    to a snapshot file. The file is replaced atomically, so open snapshots stay valid.
+    Returns the catalog version stored in the header.
+    """
+    records = sorted(records, key=lambda record: record["id"])
+    vocabulary = sorted({ingredient for record in records for ingredient, _ in record["ingredients"]})
+    vocabulary_index = {ingredient: i for i, ingredient in enumerate(vocabulary)}
+
+    # Ingredient lists in CSR form: row i owns indices[indptr[i]:indptr[i + 1]]
+    pairs = [pair for record in records for pair in record["ingredients"]]
+    indptr = np.zeros(len(records) + 1, dtype="<i4")
+    indptr[1:] = np.cumsum([len(record["ingredients"]) for record in records], dtype="<i4")
+
+    arrays = {
+        "id": np.array([record["id"] for record in records], dtype="<i4"),
+        "ingredients.indptr": indptr,
+        "ingredients.indices": np.array([vocabulary_index[ingredient] for ingredient, _ in pairs], dtype="<i4"),
+    }
+    string_columns = {column: [record[column] for record in records] for column in STRING_COLUMNS}
+    string_columns["measure"] = [measure for _, measure in pairs]
+    string_columns["vocabulary"] = vocabulary
+    for column, values in string_columns.items():
+        for part, array in _encode_strings(values).items():
+            arrays[f"{column}.{part}"] = array
+
+    # Lay sections out back to back, each aligned for zero-copy views
+    sections = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = _align(offset)
+        sections[name] = (array.dtype.str, offset, len(array))
+        offset += array.nbytes
+
+    version = catalog_version({
+        record["name"]: content_hash({key: value for key, value in record.items() if key != "id"})
+        for record in records
+    })
+    header = json.dumps({"catalog_version": version,
+                         "num_cocktails": len(records),
+                         "num_ingredients": len(vocabulary),
+                         "sections": sections}).encode("utf-8")
+    data_start = _align(_PREAMBLE.size + len(header))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + sections[name][1])
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+    return version
+
+
+def write_snapshot_from_db(engine, path: str = SNAPSHOT_PATH) -> str:
+    """Builds a snapshot of the catalog currently stored in the database. Returns its catalog version."""
+    with Session(engine) as session:
+        cocktails = session.query(Cocktail).options(selectinload(Cocktail.ingredients)).all()
+        records = [dict(record_from_cocktail(cocktail), id=cocktail.id) for cocktail in cocktails]
+    return write_snapshot(path, records)
+
+
+def update_snapshot_from_db(engine, diff, path: str = SNAPSHOT_PATH):
+    """
+    Applies a sync's CatalogDiff to the snapshot: unchanged cocktails are copied from the existing file
+    and only inserted and updated ones are read from the database. Falls back to a full rebuild if the
+    existing snapshot does not match the catalog the diff was computed against.
+    """
+    try:
+        snapshot = CatalogSnapshot(path)
+    except (OSError, ValueError, KeyError):
+        snapshot = None
+    if snapshot is None or snapshot.catalog_version != diff.base_version:
+        write_snapshot_from_db(engine, path)
+        return
+
+    changed = diff.changed_names
+    names = snapshot.columns["name"]
+    records = [snapshot.cocktail(row) for row in range(len(snapshot)) if names[row] not in changed]
+
+    upserted = list(diff.inserted) + list(diff.updated)
+    if upserted:
+        with Session(engine) as session:
+            cocktails = (session.query(Cocktail).options(selectinload(Cocktail.ingredients))
+                         .filter(Cocktail.name.in_(upserted)).all())
+            records.extend(dict(record_from_cocktail(cocktail), id=cocktail.id) for cocktail in cocktails)
+    write_snapshot(path, records)
+
+
+def load_catalog_snapshot(engine, path: str = SNAPSHOT_PATH) -> CatalogSnapshot:
+    """
+    Maps the snapshot for the running service. It is rebuilt from the database first if it is missing,
+    unreadable or its version differs from the one create_db.py / catalog_sync.py recorded in catalog_meta.
+    """
+    global _current_snapshot
+    try:
+        snapshot = CatalogSnapshot(path)
+    except (OSError, ValueError, KeyError):
+        snapshot = None
+
+    CatalogMeta.__table__.create(engine, checkfirst=True)  # Databases created before catalog_meta existed
+    with Session(engine) as session:
+        stored_version = get_stored_catalog_version(session)
+
+    if snapshot is None or snapshot.catalog_version != stored_version:
+        version = write_snapshot_from_db(engine, path)
+        if stored_version is None:
+            # First start on a database without a recorded version: record the one just computed
+            with Session(engine) as session:
+                set_stored_catalog_version(session, version)
+                session.commit()
+        snapshot = CatalogSnapshot(path)
+
+    _current_snapshot = snapshot
+    return _current_snapshot
+
+
+def reload_catalog_snapshot_if_changed(path: str = SNAPSHOT_PATH) -> bool:
+    """
+    Remaps the snapshot if the file was replaced (e.g. by create_db.py or catalog_sync.py).
+    Returns True if a new snapshot was mapped.
+    """
+    global _current_snapshot
+    try:
+        file_id = _file_id(os.stat(path))
+    except FileNotFoundError:
+        return False
+    if _current_snapshot is not None and _current_snapshot.file_id == file_id:
+        return False
+
+    _current_snapshot = CatalogSnapshot(path)
+    return True
+
+
+def get_catalog_snapshot():
+    """Returns the snapshot loaded by the service, or None if none is loaded."""
+    return _current_snapshot
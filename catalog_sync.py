@@ -0,0 +1,255 @@
+import argparse
+import ast
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import pandas as pd
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, selectinload
+
+from models_tools import Base, CatalogMeta, Cocktail, CocktailIngredient
+
+logger = logging.getLogger(__name__)
+
+# Largest share of the catalog a sync may delete without allow_deletes
+MAX_DELETE_FRACTION = float(os.getenv("CATALOG_MAX_DELETE_FRACTION", "0.1"))
+
+# Callbacks invoked with a CatalogDiff after a sync has been committed
+_invalidation_hooks = []
+
+
+class CatalogSyncError(Exception):
+    """
+    Raised when a dump cannot be synced safely. Nothing is written to the catalog.
+    """
+
+
+@dataclass
+class CatalogDiff:
+    """
+    Changes between a dataset dump and the catalog currently stored in the database.
+    Keys are cocktail names, values are normalized cocktail records.
+    """
+    inserted: dict = field(default_factory=dict)
+    updated: dict = field(default_factory=dict)
+    deleted: set = field(default_factory=set)
+    catalog_size: int = 0  # Number of cocktails stored before the sync
+    base_version: str = None  # Catalog version before the sync, see catalog_version
+    version: str = None  # Catalog version after the sync
+
+    @property
+    def changed_names(self) -> set:
+        return set(self.inserted) | set(self.updated) | self.deleted
+
+    def __bool__(self):
+        return bool(self.inserted or self.updated or self.deleted)
+
+
+def register_invalidation_hook(hook):
+    """
+    Registers a callback that receives the CatalogDiff of every applied sync,
+    so derived indexes and caches can refresh only what changed.
+    """
+    _invalidation_hooks.append(hook)
+    return hook
+
+
+def _lower(value):
+    return value.lower() if isinstance(value, str) else value
+
+
+def _parse_list(value):
+    """Parses a stringified Python list from the dataset (e.g. "['Gin', 'Lemon Juice']")."""
+    if not isinstance(value, str) or not value.strip():
+        return []
+    return list(ast.literal_eval(value))
+
+
+def normalize_row(row: dict) -> dict:
+    """
+    Converts a raw dataset row into the normalized record stored in the database.
+    Uses the same normalization as create_db.py.
+    """
+    ingredients = _parse_list(row.get("ingredients"))
+    measures = _parse_list(row.get("ingredientMeasures"))
+
+    return {
+        "name": row["name"],
+        "alcoholic": _lower(row.get("alcoholic")),
+        "category": _lower(row.get("category")),
+        "glass_type": _lower(row.get("glassType")),
+        "instruction": row.get("instructions"),
+        "drink_thumbnail": row.get("drinkThumbnail"),
+        "ingredients": [[_lower(ingredient), measure] for ingredient, measure in zip(ingredients, measures)],
+    }
+
+
+def record_from_cocktail(cocktail: Cocktail) -> dict:
+    """Builds a normalized record from a stored cocktail (ingredients in insertion order)."""
+    return {
+        "name": cocktail.name,
+        "alcoholic": cocktail.alcoholic,
+        "category": cocktail.category,
+        "glass_type": cocktail.glass_type,
+        "instruction": cocktail.instruction,
+        "drink_thumbnail": cocktail.drink_thumbnail,
+        "ingredients": [[ing.ingredient, ing.measure]
+                        for ing in sorted(cocktail.ingredients, key=lambda ing: ing.id)],
+    }
+
+
+def content_hash(record: dict) -> str:
+    """Stable hash of a normalized cocktail record."""
+    payload = json.dumps(record, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def catalog_version(hashes: dict) -> str:
+    """Fingerprint of a whole catalog, from the content hash of each cocktail keyed by name."""
+    digest = hashlib.sha256()
+    for name in sorted(hashes):
+        digest.update(f"{name}\0{hashes[name]}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def stored_content_hashes(session: Session) -> dict:
+    """Content hash of every stored cocktail, keyed by name."""
+    return {
+        cocktail.name: content_hash(record_from_cocktail(cocktail))
+        for cocktail in session.query(Cocktail).options(selectinload(Cocktail.ingredients))
+    }
+
+
+def get_stored_catalog_version(session: Session):
+    """Returns the catalog version recorded in catalog_meta, or None if none was recorded yet."""
+    meta = session.get(CatalogMeta, 1)
+    return meta.catalog_version if meta else None
+
+
+def set_stored_catalog_version(session: Session, version: str):
+    """Records the catalog version in catalog_meta (the caller commits)."""
+    session.merge(CatalogMeta(id=1, catalog_version=version))
+
+
+def load_dump(dump_dir) -> dict:
+    """
+    Loads every CSV file of a dataset dump directory into normalized records keyed by name.
+    Files are read in name order, so a later file overrides earlier rows for the same cocktail.
+    """
+    if not Path(dump_dir).is_dir():
+        raise CatalogSyncError(f"Dump directory {dump_dir} does not exist")
+
+    records = {}
+    for csv_file in sorted(Path(dump_dir).glob("*.csv")):
+        df = pd.read_csv(csv_file)
+        df = df.astype(object).where(df.notna(), None)  # NaN -> None
+        for row in df.to_dict(orient="records"):
+            if not row.get("name"):
+                continue
+            record = normalize_row(row)
+            records[record["name"]] = record
+
+    # An empty dump would otherwise delete the whole catalog
+    if not records:
+        raise CatalogSyncError(f"Dump directory {dump_dir} contains no cocktail records")
+    return records
+
+
+def diff_catalog(session: Session, records: dict) -> CatalogDiff:
+    """Compares dump records with the stored catalog by content hash per cocktail."""
+    stored = stored_content_hashes(session)
+    dump_hashes = {name: content_hash(record) for name, record in records.items()}
+
+    # After the sync the catalog matches the dump exactly
+    diff = CatalogDiff(catalog_size=len(stored),
+                       base_version=catalog_version(stored),
+                       version=catalog_version(dump_hashes))
+    for name, record in records.items():
+        if name not in stored:
+            diff.inserted[name] = record
+        elif stored[name] != dump_hashes[name]:
+            diff.updated[name] = record
+    diff.deleted = set(stored) - set(records)
+    return diff
+
+
+def _apply_record(cocktail: Cocktail, record: dict):
+    cocktail.alcoholic = record["alcoholic"]
+    cocktail.category = record["category"]
+    cocktail.glass_type = record["glass_type"]
+    cocktail.instruction = record["instruction"]
+    cocktail.drink_thumbnail = record["drink_thumbnail"]
+    cocktail.ingredients = [CocktailIngredient(ingredient=ingredient, measure=measure)
+                            for ingredient, measure in record["ingredients"]]
+
+
+def apply_diff(session: Session, diff: CatalogDiff):
+    """Applies inserts, updates and deletes to the session (the caller commits)."""
+    if diff.deleted:
+        for cocktail in session.query(Cocktail).filter(Cocktail.name.in_(diff.deleted)):
+            session.delete(cocktail)
+
+    if diff.updated:
+        for cocktail in session.query(Cocktail).filter(Cocktail.name.in_(list(diff.updated))):
+            _apply_record(cocktail, diff.updated[cocktail.name])
+
+    for name, record in diff.inserted.items():
+        cocktail = Cocktail(name=name)
+        _apply_record(cocktail, record)
+        session.add(cocktail)
+
+
+def sync_catalog(engine, dump_dir, allow_deletes: bool = False) -> CatalogDiff:
+    """
+    Incrementally syncs the catalog with a dataset dump in a single transaction,
+    then notifies the registered invalidation hooks about what changed.
+    Refuses to delete more than MAX_DELETE_FRACTION of the catalog unless allow_deletes is set.
+    A failing hook is logged, not raised: the catalog changes are already committed.
+    """
+    records = load_dump(dump_dir)
+    with Session(engine) as session, session.begin():
+        diff = diff_catalog(session, records)
+        if not allow_deletes and len(diff.deleted) > diff.catalog_size * MAX_DELETE_FRACTION:
+            raise CatalogSyncError(
+                f"Sync would delete {len(diff.deleted)} of {diff.catalog_size} cocktails; "
+                f"pass allow_deletes (--allow-deletes) if this is intended"
+            )
+        if diff:
+            apply_diff(session, diff)
+        set_stored_catalog_version(session, diff.version)
+
+    if diff:
+        for hook in _invalidation_hooks:
+            try:
+                hook(diff)
+            except Exception:
+                logger.exception(
+                    "Catalog changes were committed, but invalidation hook %r failed. Derived data such as "
+                    "the catalog snapshot may be stale; restarting the service rebuilds the snapshot", hook
+                )
+    return diff
+
+
+if __name__ == "__main__":
+    # Imported here because catalog_snapshot depends on this module
+    from catalog_snapshot import SNAPSHOT_PATH, update_snapshot_from_db
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    engine = create_engine(os.getenv("DATABASE_URL"))
+    Base.metadata.create_all(engine)  # Creates missing tables only, existing data is kept
+    register_invalidation_hook(lambda diff: update_snapshot_from_db(engine, diff, SNAPSHOT_PATH))
+
+    parser = argparse.ArgumentParser(description="Incrementally sync the catalog with a dataset dump.")
+    parser.add_argument("dump_dir", nargs="?", default="data/", help="Directory with the dump's CSV files")
+    parser.add_argument("--allow-deletes", action="store_true",
+                        help="Apply the sync even if it deletes a large share of the catalog")
+    args = parser.parse_args()
+
+    diff = sync_catalog(engine, args.dump_dir, allow_deletes=args.allow_deletes)
+    print(f"Inserted: {len(diff.inserted)}, updated: {len(diff.updated)}, deleted: {len(diff.deleted)}")
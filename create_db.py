@@ -3,6 +3,8 @@ import pandas as pd
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from catalog_snapshot import SNAPSHOT_PATH, write_snapshot_from_db
+from catalog_sync import catalog_version, content_hash, normalize_row, set_stored_catalog_version
 from models_tools import Base, Cocktail, CocktailIngredient
 
 # Load environment variables
@@ -25,29 +27,38 @@ csv_file = "data/final_cocktails.csv"
 df = pd.read_csv(csv_file)
 
 # Insert cocktails and their ingredients
-for _, row in df.iterrows():
+df = df.astype(object).where(df.notna(), None)  # NaN -> None
+content_hashes = {}
+for row in df.to_dict(orient="records"):
+    # Normalize the row the same way incremental syncs do, so content hashes match
+    record = normalize_row(row)
+    content_hashes[record["name"]] = content_hash(record)
+
     # Create a cocktail entry
     cocktail = Cocktail(
-        name=row["name"],
-        alcoholic=row["alcoholic"].lower() if isinstance(row["alcoholic"], str) else row["alcoholic"],
-        category=row["category"].lower() if isinstance(row["category"], str) else row["category"],
-        glass_type=row["glassType"].lower() if isinstance(row["glassType"], str) else row["glassType"],
-        instruction=row["instructions"],
-        drink_thumbnail=row["drinkThumbnail"]
+        name=record["name"],
+        alcoholic=record["alcoholic"],
+        category=record["category"],
+        glass_type=record["glass_type"],
+        instruction=record["instruction"],
+        drink_thumbnail=record["drink_thumbnail"]
     )
     session.add(cocktail)
     session.flush()  # Ensure we get the cocktail ID before committing
 
     # Add ingredients with their measures
-    ingredients = eval(row["ingredients"])
-    measures = eval(row["ingredientMeasures"])
-
-    for ingredient, measure in zip(ingredients, measures):
+    for ingredient, measure in record["ingredients"]:
         session.add(CocktailIngredient(
             cocktail_id=cocktail.id,
-            ingredient=ingredient.lower() if isinstance(ingredient, str) else ingredient,
+            ingredient=ingredient,
             measure=measure
         ))
 
+# Record the catalog version the service checks its snapshot against
+set_stored_catalog_version(session, catalog_version(content_hashes))
+
 # Commit all changes
 session.commit()
+
+# Write the catalog snapshot the service maps on startup
+write_snapshot_from_db(engine, SNAPSHOT_PATH)
@@ -1,18 +1,77 @@
+import asyncio
 import json
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Depends, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
 from openai import OpenAI
 from pydantic import BaseModel
+from admission import AdmissionController, RateLimitExceeded
+from catalog_snapshot import load_catalog_snapshot, reload_catalog_snapshot_if_changed
+from migrate_messages import migrate_message_history
+from profiling import list_profiles, profiled_thread, profiling_middleware, read_profile, require_admin
+from ranking import invalidate_popularity
 from tools_functions import *
 
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_PRUNE_INTERVAL = 3600  # Seconds between message retention runs
+CATALOG_CHECK_INTERVAL = 60  # Seconds between checks for a rewritten catalog snapshot
+
+
+def prune_messages():
+    with Session(engine) as session:
+        prune_message_history(session)
+
+
+async def prune_messages_periodically():
+    """Background task applying message retention while the app runs."""
+    while True:
+        try:
+            await asyncio.to_thread(prune_messages)
+        except Exception:
+            logger.exception("Message pruning failed")
+        await asyncio.sleep(MESSAGE_PRUNE_INTERVAL)
+
+
+async def watch_catalog_snapshot():
+    """Background task remapping the catalog snapshot after create_db.py or catalog_sync.py rewrites it."""
+    while True:
+        await asyncio.sleep(CATALOG_CHECK_INTERVAL)
+        try:
+            if await asyncio.to_thread(reload_catalog_snapshot_if_changed):
+                invalidate_popularity()  # The catalog changed in another process
+        except Exception:
+            logger.exception("Reloading the catalog snapshot failed")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Migrates message history if needed, maps the catalog snapshot and starts the background tasks."""
+    migrate_message_history(engine)
+    load_catalog_snapshot(engine)
+    tasks = [asyncio.create_task(prune_messages_periodically()),
+             asyncio.create_task(watch_catalog_snapshot())]
+    yield
+    for task in tasks:
+        task.cancel()
+
+
 # Initialize FastAPI app and templates
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 templates = Jinja2Templates(directory="templates")
 
+# Opt-in sampling profiler for slow requests
+app.middleware("http")(profiling_middleware)
+
 # Initialize LLM with OpenAI API key
 llm = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+# Bounds per-user and global request rates and the number of concurrent LLM calls
+admission = AdmissionController()
+
 
 class UserQuery(BaseModel):
     user_input: str  # Defines the expected input format
@@ -24,91 +83,112 @@ async def get_chat_page(request: Request):
     return templates.TemplateResponse("chat.html", {"request": request})
 
 
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def get_profiles():
+    """Lists stored request profiles, newest first."""
+    return list_profiles()
+
+
+@app.get("/admin/profiles/{name}", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def get_profile(name: str):
+    """Returns a stored profile in collapsed-stack format (input for flamegraph.pl or speedscope)."""
+    return read_profile(name)
+
+
 @app.post("/cocktail_request")
 async def handle_cocktail_request(user_query: UserQuery, user_id: int = Depends(get_user_id)):
     """Handles user cocktail requests by parsing them with LLM and querying the database."""
     try:
-        # Retrieve user's message history from the database
-        with Session(engine) as session:
-            user_data = session.query(UserData).filter_by(user_id=user_id).first()
-            message_history = user_data.message_history if user_data else []
-
-        # Construct conversation history for LLM
-        messages = [{"role": "system", "content": "You are a cocktail assistant. "
-                                                 "Your job is to provide users with information about cocktails they ask for, "
-                                                 "as well as to recommend cocktails if requested."}]
-
-        # Append previous user-bot exchanges
-        for pair in message_history:
-            messages.append({"role": "user", "content": pair["user"]})
-            messages.append({"role": "assistant", "content": pair["bot"]})
-
-        # Add the current user query
-        messages.append({"role": "user", "content": user_query.user_input})
-
-        # Generate response using LLM
-        completion = llm.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            tools=tools
-        )
-
-        tool_calls = []
-        retrieved_info = []
-        retrieved_preferences = None
-        llm_response = None
-
-        # Process tool calls from the LLM response
-        if completion.choices[0].message.tool_calls:
-            for tool_call_obj in completion.choices[0].message.tool_calls:
-                tool_call = tool_call_obj.function.name
-                arguments = json.loads(tool_call_obj.function.arguments)
-                arguments["user_id"] = user_id  # Ensure user_id is included
-                tool_calls.append({"name": tool_call, "arguments": arguments})
-
-                # Call the corresponding function based on LLM request
-                if tool_call == "parse_cocktail_info_request":
-                    retrieved_info.extend(parse_cocktail_info_request(**arguments))
-                elif tool_call == "parse_cocktail_recommendation_request":
-                    retrieved_info.extend(parse_cocktail_recommendation_request(**arguments))
-                elif tool_call == "parse_cocktail_similar_request":
-                    retrieved_info.extend(parse_cocktail_similar_request(**arguments))
-                elif tool_call == "update_user_preferences":
-                    update_user_preferences(**arguments)
-                elif tool_call == "get_user_preferences":
-                    retrieved_preferences = get_user_preferences(**arguments)
-                elif tool_call == "clear_user_preferences":
-                    clear_user_preferences(**arguments)
-
-        # Generate LLM response based on retrieved data
-        if retrieved_info:
-            cocktail_text = "\n".join([f"- {c.name}: {c.instruction}" for c in retrieved_info])
-            messages.append({"role": "assistant",
-                             "content": f"I have found the following cocktails based on your request:\n{cocktail_text}"})
-            messages.append({"role": "user", "content": "Please generate a response based on this information."})
-
-        if retrieved_preferences:
-            preferences_text = json.dumps(retrieved_preferences, indent=2)
-            messages.append({"role": "assistant",
-                             "content": f"The user's preferences are:\n{preferences_text}."
-                                        f"Consider these preferences when generating your response."})
-
-        # Generate final response
-        llm_response = llm.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages
-        ).choices[0].message.content
-
-        # Update message history in the database
-        with Session(engine) as session:
-            update_message_history(session, user_id, user_query.user_input, llm_response)
-
-        return {
-            "tool_calls": tool_calls,
-            "retrieved_info": [c.__dict__ for c in retrieved_info] if retrieved_info else None,
-            "retrieved_preferences": retrieved_preferences if retrieved_preferences else None,
-            "llm_response": llm_response
-        }
+        return await admission.run(user_id, user_query.user_input,
+                                   process_cocktail_request, user_query, user_id)
+
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": e.retry_after_header})
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@profiled_thread
+def process_cocktail_request(user_query: UserQuery, user_id: int):
+    """Runs a single chat turn: LLM tool selection, database lookups and the final LLM response."""
+    # Retrieve user's message history from the database
+    with Session(engine) as session:
+        message_history = get_message_history(session, user_id)
+
+    # Construct conversation history for LLM
+    messages = [{"role": "system", "content": "You are a cocktail assistant. "
+                                             "Your job is to provide users with information about cocktails they ask for, "
+                                             "as well as to recommend cocktails if requested."}]
+
+    # Append previous user-bot exchanges
+    for pair in message_history:
+        messages.append({"role": "user", "content": pair["user"]})
+        messages.append({"role": "assistant", "content": pair["bot"]})
+
+    # Add the current user query
+    messages.append({"role": "user", "content": user_query.user_input})
+
+    # Generate response using LLM
+    completion = llm.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=messages,
+        tools=tools
+    )
+
+    tool_calls = []
+    retrieved_info = []
+    retrieved_preferences = None
+    llm_response = None
+
+    # Process tool calls from the LLM response
+    if completion.choices[0].message.tool_calls:
+        for tool_call_obj in completion.choices[0].message.tool_calls:
+            tool_call = tool_call_obj.function.name
+            arguments = json.loads(tool_call_obj.function.arguments)
+            arguments["user_id"] = user_id  # Ensure user_id is included
+            tool_calls.append({"name": tool_call, "arguments": arguments})
+
+            # Call the corresponding function based on LLM request
+            if tool_call == "parse_cocktail_info_request":
+                retrieved_info.extend(parse_cocktail_info_request(**arguments))
+            elif tool_call == "parse_cocktail_recommendation_request":
+                retrieved_info.extend(parse_cocktail_recommendation_request(**arguments))
+            elif tool_call == "parse_cocktail_similar_request":
+                retrieved_info.extend(parse_cocktail_similar_request(**arguments))
+            elif tool_call == "update_user_preferences":
+                update_user_preferences(**arguments)
+            elif tool_call == "get_user_preferences":
+                retrieved_preferences = get_user_preferences(**arguments)
+            elif tool_call == "clear_user_preferences":
+                clear_user_preferences(**arguments)
+
+    # Generate LLM response based on retrieved data
+    if retrieved_info:
+        cocktail_text = "\n".join([f"- {c.name}: {c.instruction}" for c in retrieved_info])
+        messages.append({"role": "assistant",
+                         "content": f"I have found the following cocktails based on your request:\n{cocktail_text}"})
+        messages.append({"role": "user", "content": "Please generate a response based on this information."})
+
+    if retrieved_preferences:
+        preferences_text = json.dumps(retrieved_preferences, indent=2)
+        messages.append({"role": "assistant",
+                         "content": f"The user's preferences are:\n{preferences_text}."
+                                    f"Consider these preferences when generating your response."})
+
+    # Generate final response
+    llm_response = llm.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=messages
+    ).choices[0].message.content
+
+    # Update message history in the database
+    with Session(engine) as session:
+        update_message_history(session, user_id, user_query.user_input, llm_response)
+
+    return {
+        "tool_calls": tool_calls,
+        "retrieved_info": [c.__dict__ for c in retrieved_info] if retrieved_info else None,
+        "retrieved_preferences": retrieved_preferences if retrieved_preferences else None,
+        "llm_response": llm_response
+    }
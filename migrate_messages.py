@@ -0,0 +1,48 @@
+import os
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, inspect, text
+from models_tools import Message
+
+# Arbitrary key of the advisory lock that serializes migrations of concurrently starting workers
+MIGRATION_LOCK_KEY = 734120031
+
+
+def migrate_message_history(engine) -> bool:
+    """
+    Creates the append-only messages table and its indexes if needed and moves history from the old
+    user_data.message_history JSONB column into it, keeping the order of exchanges.
+    Safe to run on every startup. Returns True if old history was migrated.
+    """
+    with engine.begin() as connection:
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        Message.__table__.create(connection, checkfirst=True)
+
+        # Bring indexes of an existing messages table up to date
+        connection.execute(text("DROP INDEX IF EXISTS ix_messages_user_id_created_at"))
+        for index in Message.__table__.indexes:
+            index.create(connection, checkfirst=True)
+
+        inspector = inspect(connection)
+        if not inspector.has_table("user_data"):
+            return False
+        columns = [column["name"] for column in inspector.get_columns("user_data")]
+        if "message_history" not in columns:
+            return False
+
+        connection.execute(text(
+            "INSERT INTO messages (user_id, user_message, bot_response) "
+            "SELECT user_data.user_id, pair.value ->> 'user', pair.value ->> 'bot' "
+            "FROM user_data, jsonb_array_elements(user_data.message_history) WITH ORDINALITY AS pair(value, position) "
+            "ORDER BY user_data.user_id, pair.position"
+        ))
+        connection.execute(text("ALTER TABLE user_data DROP COLUMN message_history"))
+        return True
+
+
+if __name__ == "__main__":
+    # Load environment variables
+    load_dotenv()
+
+    # Database connection
+    engine = create_engine(os.getenv("DATABASE_URL"))
+    migrate_message_history(engine)
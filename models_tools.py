@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Text
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, Text, DateTime, Index, text
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
@@ -34,15 +34,40 @@ class CocktailIngredient(Base):
 
     cocktail = relationship("Cocktail", back_populates="ingredients")
 
+class CatalogMeta(Base):
+    """
+    Single-row table holding the version of the stored catalog, updated whenever the catalog is written.
+    """
+    __tablename__ = 'catalog_meta'
+
+    id = Column(Integer, primary_key=True)  # Always 1
+    catalog_version = Column(String, nullable=False)  # See catalog_sync.catalog_version
+
 class UserData(Base):
     """
-    Stores user preferences and recent message history.
+    Stores user preferences.
     """
     __tablename__ = 'user_data'
 
     user_id = Column(Integer, primary_key=True)  # User ID
     preferences = Column(JSONB, nullable=False, default={})  # JSONB field for storing preferences
-    message_history = Column(JSONB, nullable=False, default=[])  # Stores the last N messages
+
+class Message(Base):
+    """
+    Represents one user-bot exchange. Rows are only appended; old ones are removed by retention pruning.
+    """
+    __tablename__ = 'messages'
+    __table_args__ = (
+        Index('ix_messages_user_id_created_at_id', 'user_id', 'created_at', 'id'),  # "Last N turns" reads
+        Index('ix_messages_created_at', 'created_at'),  # Retention pruning
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    user_message = Column(Text, nullable=False)
+    bot_response = Column(Text, nullable=False)
+    # Rows with equal timestamps (e.g. history migrated in bulk) are ordered by id
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=text("clock_timestamp()"))
 
 
 tools = [
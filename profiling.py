@@ -0,0 +1,159 @@
+import contextvars
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from functools import wraps
+from pathlib import Path
+
+from fastapi import Header, HTTPException
+
+# Profiling settings (can be overridden through environment variables)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # Fraction of requests profiled, 0 disables sampling
+PROFILE_THRESHOLD_MS = float(os.getenv("PROFILE_THRESHOLD_MS", "2000"))  # Sampled profiles are kept above this latency
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000  # Seconds between stack samples
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "profiles"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # Enables the X-Profile header and the admin endpoints
+
+PROFILE_NAME_PATTERN = re.compile(r"^[\w.-]+\.collapsed$")
+
+# Profiler of the request being handled, visible to the worker threads it starts
+_active_profiler = contextvars.ContextVar("active_profiler", default=None)
+
+
+def _collapse(frame) -> str:
+    """Formats a stack as "root;...;leaf" with one "file:function" entry per frame."""
+    entries = []
+    while frame is not None:
+        code = frame.f_code
+        entries.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(entries))
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of registered threads at a fixed interval from a background thread.
+    The event loop thread is shared by all requests, so its samples may include other requests.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self._threads = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def add_current_thread(self):
+        with self._lock:
+            self._threads.add(threading.get_ident())
+
+    def remove_current_thread(self):
+        with self._lock:
+            self._threads.discard(threading.get_ident())
+
+    def start(self):
+        self.add_current_thread()
+        self._sampler.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._sampler.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self._threads)
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.samples[_collapse(frame)] += 1
+
+    def collapsed(self) -> str:
+        """Samples in collapsed-stack format, as consumed by flamegraph.pl or speedscope."""
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.samples.items()))
+
+
+def profiled_thread(func):
+    """Includes the worker thread running `func` in the current request's profile, if any."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = _active_profiler.get()
+        if profiler is None:
+            return func(*args, **kwargs)
+        profiler.add_current_thread()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.remove_current_thread()
+    return wrapper
+
+
+def _is_admin(token) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def require_admin(x_admin_token: str = Header(None)):
+    if not _is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+def save_profile(profiler: SamplingProfiler, path: str, elapsed_ms: float) -> str:
+    """Writes the profile to PROFILE_DIR, keeping at most PROFILE_MAX_FILES files. Returns the file name."""
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    slug = re.sub(r"[^\w-]+", "_", path.strip("/")) or "root"
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{slug}-{int(elapsed_ms)}ms-{uuid.uuid4().hex[:8]}.collapsed"
+    (PROFILE_DIR / name).write_text(profiler.collapsed(), encoding="utf-8")
+
+    # Drop the oldest profiles over the limit
+    profiles = sorted(PROFILE_DIR.glob("*.collapsed"), key=lambda p: p.stat().st_mtime)
+    for old_profile in profiles[:-PROFILE_MAX_FILES]:
+        old_profile.unlink(missing_ok=True)
+    return name
+
+
+def list_profiles() -> list:
+    """Stored profiles, newest first."""
+    if not PROFILE_DIR.exists():
+        return []
+    profiles = sorted(PROFILE_DIR.glob("*.collapsed"), key=lambda p: p.stat().st_mtime, reverse=True)
+    return [{"name": p.name, "size": p.stat().st_size} for p in profiles]
+
+
+def read_profile(name: str) -> str:
+    if not PROFILE_NAME_PATTERN.match(name) or not (PROFILE_DIR / name).is_file():
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return (PROFILE_DIR / name).read_text(encoding="utf-8")
+
+
+async def profiling_middleware(request, call_next):
+    """
+    Profiles a request when an admin sends "X-Profile: 1" or when it is sampled at PROFILE_SAMPLE_RATE.
+    Forced profiles are always stored, sampled ones only above PROFILE_THRESHOLD_MS.
+    """
+    forced = request.headers.get("x-profile") == "1" and _is_admin(request.headers.get("x-admin-token"))
+    if not forced and not (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE):
+        return await call_next(request)
+
+    profiler = SamplingProfiler()
+    token = _active_profiler.set(profiler)
+    profiler.start()
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        profiler.stop()
+        _active_profiler.reset(token)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    if forced or elapsed_ms >= PROFILE_THRESHOLD_MS:
+        response.headers["X-Profile-Name"] = save_profile(profiler, request.url.path, elapsed_ms)
+    return response
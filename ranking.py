@@ -0,0 +1,251 @@
+import hashlib
+import heapq
+import json
+import os
+import random
+import time
+from dataclasses import dataclass, field
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session, selectinload
+
+from catalog_snapshot import get_catalog_snapshot
+from models_tools import Cocktail
+
+# Size of the candidate pool for seeded diversity sampling, as a multiple of the limit (1 disables sampling)
+RANKING_DIVERSITY_POOL = int(os.getenv("RANKING_DIVERSITY_POOL", "1"))
+POPULARITY_TTL = 300  # Seconds the like counts are cached for
+
+# Registered scoring features: name -> function(cocktail, context) returning a value in [0, 1]
+FEATURES = {}
+
+_popularity_cache = {"loaded_at": None, "counts": {}}
+
+
+def feature(name: str):
+    """Registers a scoring feature under the given name."""
+    def register(func):
+        FEATURES[name] = func
+        return func
+    return register
+
+
+def jaccard_similarity(set1, set2) -> float:
+    union = len(set1 | set2)
+    return len(set1 & set2) / union if union != 0 else 0.0
+
+
+@dataclass
+class RankingContext:
+    """
+    Everything the features need to know about the user and the request.
+    Ingredient sets of candidates are memoized per context.
+    """
+    liked_cocktails: set = field(default_factory=set)
+    liked_ingredients: set = field(default_factory=set)
+    liked_categories: set = field(default_factory=set)
+    liked_profiles: list = field(default_factory=list)  # (ingredients, category) of liked cocktails
+    reference_profiles: list = field(default_factory=list)  # (ingredients, category) of "similar to" cocktails
+    popularity: dict = field(default_factory=dict)
+    popularity_max: int = 0  # Largest like count, normalizes the popularity feature
+    _ingredient_sets: dict = field(default_factory=dict)
+
+    def ingredients_of(self, cocktail: Cocktail) -> frozenset:
+        ingredients = self._ingredient_sets.get(cocktail.id)
+        if ingredients is None:
+            ingredients = frozenset(ing.ingredient for ing in cocktail.ingredients)
+            self._ingredient_sets[cocktail.id] = ingredients
+        return ingredients
+
+
+@dataclass
+class RankedCocktail:
+    cocktail: Cocktail
+    score: float
+    breakdown: dict  # Feature name -> weighted contribution
+
+    def sort_key(self):
+        # Ties are broken by ID, so equal scores always come out in the same order
+        return self.score, -self.cocktail.id
+
+
+@feature("liked_cocktail")
+def liked_cocktail_feature(cocktail, context):
+    return 1.0 if cocktail.name in context.liked_cocktails else 0.0
+
+
+@feature("liked_ingredients")
+def liked_ingredients_feature(cocktail, context):
+    if not context.liked_ingredients:
+        return 0.0
+    return len(context.ingredients_of(cocktail) & context.liked_ingredients) / len(context.liked_ingredients)
+
+
+@feature("liked_categories")
+def liked_categories_feature(cocktail, context):
+    return 1.0 if cocktail.category in context.liked_categories else 0.0
+
+
+@feature("liked_similarity")
+def liked_similarity_feature(cocktail, context):
+    ingredients = context.ingredients_of(cocktail)
+    return max((jaccard_similarity(ingredients, liked) for liked, _ in context.liked_profiles), default=0.0)
+
+
+@feature("reference_similarity")
+def reference_similarity_feature(cocktail, context):
+    # Average of ingredient and category Jaccard similarity to the closest reference cocktail
+    ingredients = context.ingredients_of(cocktail)
+    return max(
+        ((jaccard_similarity(ingredients, ref_ingredients) + (1.0 if cocktail.category == ref_category else 0.0)) / 2
+         for ref_ingredients, ref_category in context.reference_profiles),
+        default=0.0
+    )
+
+
+@feature("popularity")
+def popularity_feature(cocktail, context):
+    if not context.popularity_max:
+        return 0.0
+    return context.popularity.get(cocktail.name, 0) / context.popularity_max
+
+
+class RankingEngine:
+    """
+    Scores cocktails as a weighted sum of registered features and selects the top K
+    with a heap instead of sorting the whole candidate set.
+    """
+
+    def __init__(self, weights: dict, pinned_features=()):
+        unknown = (set(weights) | set(pinned_features)) - set(FEATURES)
+        if unknown:
+            raise ValueError(f"Unknown ranking features: {', '.join(sorted(unknown))}")
+        self.weights = weights
+        self.pinned_features = pinned_features  # Results with any of these features are never sampled away
+
+    def is_pinned(self, ranked: RankedCocktail) -> bool:
+        return any(ranked.breakdown.get(name) for name in self.pinned_features)
+
+    def score(self, cocktail: Cocktail, context: RankingContext) -> RankedCocktail:
+        breakdown = {name: weight * FEATURES[name](cocktail, context) for name, weight in self.weights.items()}
+        return RankedCocktail(cocktail, sum(breakdown.values()), breakdown)
+
+    def top_k(self, cocktails, context: RankingContext, k: int, seed: int = None,
+              pool_factor: int = RANKING_DIVERSITY_POOL) -> list:
+        """
+        Returns the best `k` cocktails in rank order. With pool_factor > 1 the pinned results among the best `k`
+        come first and the rest is a weighted sample from the best k * pool_factor candidates,
+        reproducible for the same seed.
+        """
+        scored = (self.score(cocktail, context) for cocktail in cocktails)
+        pool = heapq.nlargest(k * max(1, pool_factor), scored, key=RankedCocktail.sort_key)
+        if pool_factor <= 1 or len(pool) <= k:
+            return pool[:k]
+
+        pinned = [ranked for ranked in pool[:k] if self.is_pinned(ranked)]
+        candidates = [ranked for ranked in pool if not any(ranked is kept for kept in pinned)]
+
+        # Weighted sampling without replacement (Efraimidis-Spirakis): keep the largest u ** (1 / weight)
+        rng = random.Random(seed)
+        sampled = heapq.nlargest(k - len(pinned), candidates,
+                                 key=lambda ranked: rng.random() ** (1.0 / (ranked.score + 1e-3)))
+        return pinned + sorted(sampled, key=RankedCocktail.sort_key, reverse=True)
+
+
+def request_seed(*values) -> int:
+    """Derives a stable seed from request parameters (unlike hash(), it does not change between runs)."""
+    payload = json.dumps(values, sort_keys=True, default=str)
+    return int.from_bytes(hashlib.sha256(payload.encode("utf-8")).digest()[:8], "big")
+
+
+def attach_breakdowns(ranked: list) -> list:
+    """Returns the cocktails with their score breakdown attached for debugging."""
+    for item in ranked:
+        item.cocktail.score_breakdown = {"score": round(item.score, 4),
+                                         "features": {name: round(value, 4) for name, value in item.breakdown.items()}}
+    return [item.cocktail for item in ranked]
+
+
+def profile_of(cocktail: Cocktail) -> tuple:
+    """(ingredients, category) of a loaded cocktail."""
+    return frozenset(ing.ingredient for ing in cocktail.ingredients), cocktail.category
+
+
+def load_profiles(session: Session, names) -> list:
+    """
+    Returns (ingredients, category) of the named cocktails. They are read from the catalog snapshot when
+    available; names the snapshot does not contain (e.g. cocktails synced after it was built) come from the database.
+    """
+    names = set(names)
+    profiles = []
+
+    snapshot = get_catalog_snapshot()
+    if snapshot is not None:
+        missing = set()
+        for name in names:
+            row = snapshot.row_for_name(name)
+            if row is None:
+                missing.add(name)
+            else:
+                profiles.append((frozenset(snapshot.ingredients(row)), snapshot.columns["category"][row]))
+        names = missing
+
+    if names:
+        cocktails = (session.query(Cocktail).options(selectinload(Cocktail.ingredients))
+                     .filter(Cocktail.name.in_(names)).all())
+        profiles.extend(profile_of(cocktail) for cocktail in cocktails)
+    return profiles
+
+
+def load_popularity(session: Session) -> dict:
+    """Number of users who like each cocktail, cached for POPULARITY_TTL seconds."""
+    now = time.monotonic()
+    loaded_at = _popularity_cache["loaded_at"]
+    if loaded_at is None or now - loaded_at > POPULARITY_TTL:
+        rows = session.execute(text(
+            "SELECT liked.name, COUNT(*) FROM user_data, "
+            "jsonb_array_elements_text(user_data.preferences -> 'liked_cocktails') AS liked(name) "
+            "GROUP BY liked.name"
+        )).all()
+        _popularity_cache["counts"] = {name: count for name, count in rows}
+        _popularity_cache["loaded_at"] = now
+    return _popularity_cache["counts"]
+
+
+def invalidate_popularity(names=None):
+    """Drops the cached like counts of the given cocktails, or the whole cache if no names are given."""
+    if names is None:
+        _popularity_cache["loaded_at"] = None
+        _popularity_cache["counts"] = {}
+        return
+    for name in names:
+        _popularity_cache["counts"].pop(name, None)
+
+
+def build_preference_context(session: Session, preferences: dict) -> RankingContext:
+    """Builds the ranking context for a user's stored preferences."""
+    liked_profiles = load_profiles(session, preferences.get("liked_cocktails", []))
+    popularity = load_popularity(session)
+    return RankingContext(
+        liked_cocktails=set(preferences.get("liked_cocktails", [])),
+        liked_ingredients=set(preferences.get("liked_ingredients", [])),
+        liked_categories={category for _, category in liked_profiles},
+        liked_profiles=liked_profiles,
+        popularity=popularity,
+        popularity_max=max(popularity.values(), default=0),
+    )
+
+
+# Liked cocktails outweigh every other feature combined, so they always rank first,
+# and pinning keeps them ahead of diversity sampling
+recommendation_engine = RankingEngine({
+    "liked_cocktail": 4.0,
+    "liked_ingredients": 2.0,
+    "liked_similarity": 1.0,
+    "liked_categories": 0.5,
+    "popularity": 0.25,
+}, pinned_features=("liked_cocktail",))
+
+similarity_engine = RankingEngine({
+    "reference_similarity": 1.0,
+})
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+
+import pytest
+
+import admission
+from admission import AdmissionController, RateLimitExceeded, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+def unlimited_controller(**limits):
+    limits = {"user_rate": 1000, "user_burst": 1000, "global_rate": 1000, "global_burst": 1000, **limits}
+    return AdmissionController(**limits)
+
+
+def test_token_bucket_refills_at_rate_up_to_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    for _ in range(3):
+        assert bucket.wait_time() == 0
+        bucket.consume()
+    assert bucket.wait_time() == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert bucket.wait_time() == 0
+
+    clock.now += 60
+    assert bucket.is_full
+    assert bucket.tokens == 3
+
+
+def test_user_rate_limit_reports_retry_after(clock):
+    controller = AdmissionController(user_rate=0.5, user_burst=2, global_rate=100, global_burst=100)
+    controller._check_rate(1)
+    controller._check_rate(1)
+
+    with pytest.raises(RateLimitExceeded) as error:
+        controller._check_rate(1)
+    assert error.value.retry_after == pytest.approx(2.0)
+    assert error.value.retry_after_header == "2"
+
+    controller._check_rate(2)  # Other users have their own bucket
+    clock.now += 2
+    controller._check_rate(1)
+
+
+def test_retry_after_header_is_rounded_up_to_a_whole_second():
+    assert RateLimitExceeded("busy", 0.1).retry_after_header == "1"
+    assert RateLimitExceeded("busy", 2.3).retry_after_header == "3"
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    controller = unlimited_controller(max_in_flight=1, max_queued=0)
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking_call():
+        started.set()
+        release.wait(5)
+        return "done"
+
+    async def scenario():
+        first = asyncio.ensure_future(controller.run(1, "first", blocking_call))
+        await asyncio.to_thread(started.wait, 5)
+        with pytest.raises(RateLimitExceeded) as error:
+            await controller.run(2, "second", blocking_call)
+        release.set()
+        return await first, error.value
+
+    result, error = asyncio.run(scenario())
+    assert result == "done"
+    assert error.retry_after == admission.QUEUE_RETRY_AFTER
+
+
+def test_identical_in_flight_requests_are_coalesced():
+    controller = unlimited_controller()
+    release = threading.Event()
+    calls = []
+
+    def slow_call(value):
+        calls.append(value)
+        release.wait(5)
+        return value * 2
+
+    async def scenario():
+        first = asyncio.ensure_future(controller.run(1, "same question", slow_call, 21))
+        second = asyncio.ensure_future(controller.run(1, "same question", slow_call, 21))
+        other_user = asyncio.ensure_future(controller.run(2, "same question", slow_call, 1))
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(first, second, other_user)
+
+    assert asyncio.run(scenario()) == [42, 42, 2]
+    assert sorted(calls) == [1, 21]
+    assert controller._in_flight == {}
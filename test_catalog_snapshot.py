@@ -0,0 +1,137 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import catalog_snapshot
+from catalog_snapshot import CatalogSnapshot, load_catalog_snapshot, write_snapshot, write_snapshot_from_db
+from catalog_sync import get_stored_catalog_version
+from models_tools import Base, CatalogMeta, Cocktail, CocktailIngredient
+
+
+def snapshot_record(cocktail_id, name, ingredients, **columns):
+    record = {
+        "id": cocktail_id,
+        "name": name,
+        "alcoholic": "alcoholic",
+        "category": "cocktail",
+        "glass_type": "cocktail glass",
+        "instruction": "Shake with ice.",
+        "drink_thumbnail": None,
+        "ingredients": ingredients,
+    }
+    record.update(columns)
+    return record
+
+
+RECORDS = [
+    snapshot_record(7, "Margarita", [["tequila", "1 1/2 oz"], ["triple sec", "1/2 oz"], ["lime juice", "1 oz"]]),
+    snapshot_record(3, "Café Brûlot", [["cognac", None], ["coffee", "2 cups"]], glass_type=None, instruction=""),
+    snapshot_record(12, "Ice Water", []),
+]
+
+
+@pytest.fixture(autouse=True)
+def restore_current_snapshot(monkeypatch):
+    monkeypatch.setattr(catalog_snapshot, "_current_snapshot", None)
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "catalog.snapshot")
+    version = write_snapshot(path, RECORDS)
+    snapshot = CatalogSnapshot(path)
+
+    assert snapshot.catalog_version == version
+    assert list(snapshot.ids) == [3, 7, 12]  # Rows are sorted by ID
+    for record in RECORDS:
+        assert snapshot.cocktail(snapshot.row_for_id(record["id"])) == record
+        assert snapshot.row_for_name(record["name"]) == snapshot.row_for_id(record["id"])
+
+
+def test_snapshot_keeps_nulls_apart_from_empty_strings(tmp_path):
+    path = str(tmp_path / "catalog.snapshot")
+    write_snapshot(path, RECORDS)
+    snapshot = CatalogSnapshot(path)
+
+    row = snapshot.row_for_name("Café Brûlot")
+    assert snapshot.columns["glass_type"][row] is None
+    assert snapshot.columns["instruction"][row] == ""
+    assert snapshot.ingredients(row) == ["cognac", "coffee"]
+    assert snapshot.cocktail(row)["ingredients"][0] == ["cognac", None]
+
+
+def test_snapshot_lookups_of_unknown_cocktails(tmp_path):
+    path = str(tmp_path / "catalog.snapshot")
+    write_snapshot(path, RECORDS)
+    snapshot = CatalogSnapshot(path)
+
+    assert snapshot.row_for_id(5) is None
+    assert snapshot.row_for_id(100) is None
+    assert snapshot.row_for_name("Mojito") is None
+
+
+def test_empty_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "catalog.snapshot")
+    version = write_snapshot(path, [])
+    snapshot = CatalogSnapshot(path)
+
+    assert len(snapshot) == 0
+    assert snapshot.catalog_version == version
+    assert snapshot.row_for_id(1) is None
+    assert snapshot.row_for_name("Margarita") is None
+
+
+def test_snapshot_rejects_other_files(tmp_path):
+    path = tmp_path / "catalog.snapshot"
+    path.write_bytes(b"not a snapshot" * 4)
+
+    with pytest.raises(ValueError):
+        CatalogSnapshot(str(path))
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'catalog.db'}")
+    Base.metadata.create_all(engine, tables=[Cocktail.__table__, CocktailIngredient.__table__, CatalogMeta.__table__])
+    with Session(engine) as session:
+        for record in RECORDS:
+            cocktail = Cocktail(id=record["id"], name=record["name"], alcoholic=record["alcoholic"],
+                                category=record["category"], glass_type=record["glass_type"],
+                                instruction=record["instruction"], drink_thumbnail=record["drink_thumbnail"])
+            cocktail.ingredients = [CocktailIngredient(ingredient=ingredient, measure=measure)
+                                    for ingredient, measure in record["ingredients"]]
+            session.add(cocktail)
+        session.commit()
+    return engine
+
+
+def test_snapshot_from_db_matches_stored_records(engine, tmp_path):
+    path = str(tmp_path / "catalog.snapshot")
+
+    assert write_snapshot_from_db(engine, path) == write_snapshot(str(tmp_path / "expected.snapshot"), RECORDS)
+    snapshot = CatalogSnapshot(path)
+    for record in RECORDS:
+        assert snapshot.cocktail(snapshot.row_for_id(record["id"])) == record
+
+
+def test_load_rebuilds_missing_snapshot_and_records_version(engine, tmp_path):
+    path = str(tmp_path / "catalog.snapshot")
+
+    snapshot = load_catalog_snapshot(engine, path)
+
+    assert len(snapshot) == len(RECORDS)
+    with Session(engine) as session:
+        assert get_stored_catalog_version(session) == snapshot.catalog_version
+
+
+def test_load_rebuilds_snapshot_of_another_catalog_version(engine, tmp_path):
+    path = str(tmp_path / "catalog.snapshot")
+    stored_version = write_snapshot(path, RECORDS)
+    with Session(engine) as session:
+        session.add(CatalogMeta(id=1, catalog_version=stored_version))
+        session.commit()
+    write_snapshot(path, RECORDS[:1])  # Stale snapshot
+
+    snapshot = load_catalog_snapshot(engine, path)
+
+    assert snapshot.catalog_version == stored_version
+    assert len(snapshot) == len(RECORDS)
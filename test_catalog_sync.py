@@ -0,0 +1,133 @@
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import catalog_sync
+from catalog_sync import CatalogSyncError, get_stored_catalog_version, register_invalidation_hook, sync_catalog
+from models_tools import Base, CatalogMeta, Cocktail, CocktailIngredient
+
+COLUMNS = ["name", "alcoholic", "category", "glassType", "instructions", "drinkThumbnail",
+           "ingredients", "ingredientMeasures"]
+
+
+def cocktail_row(name, ingredients, instructions="Shake with ice."):
+    return {
+        "name": name,
+        "alcoholic": "Alcoholic",
+        "category": "Cocktail",
+        "glassType": "Cocktail glass",
+        "instructions": instructions,
+        "drinkThumbnail": None,
+        "ingredients": str(ingredients),
+        "ingredientMeasures": str(["1 oz"] * len(ingredients)),
+    }
+
+
+def write_dump(dump_dir, rows):
+    dump_dir.mkdir(exist_ok=True)
+    pd.DataFrame(rows, columns=COLUMNS).to_csv(dump_dir / "cocktails.csv", index=False)
+    return dump_dir
+
+
+@pytest.fixture
+def engine(tmp_path):
+    # SQLite covers the catalog tables; user_data and messages need PostgreSQL
+    engine = create_engine(f"sqlite:///{tmp_path / 'catalog.db'}")
+    Base.metadata.create_all(engine, tables=[Cocktail.__table__, CocktailIngredient.__table__, CatalogMeta.__table__])
+    return engine
+
+
+@pytest.fixture
+def synced_engine(engine, tmp_path):
+    rows = [cocktail_row(f"Cocktail {i}", ["Gin", "Lime Juice"]) for i in range(10)]
+    sync_catalog(engine, write_dump(tmp_path / "initial", rows))
+    return engine
+
+
+def stored_catalog(engine):
+    with Session(engine) as session:
+        return {
+            cocktail.name: (cocktail.instruction, sorted(ing.ingredient for ing in cocktail.ingredients))
+            for cocktail in session.query(Cocktail)
+        }
+
+
+def test_sync_applies_inserts_updates_and_deletes(synced_engine, tmp_path):
+    rows = [cocktail_row(f"Cocktail {i}", ["Gin", "Lime Juice"]) for i in range(1, 10)]  # "Cocktail 0" removed
+    rows[0] = cocktail_row("Cocktail 1", ["Rum", "Lime Juice"], "Stir.")  # Changed
+    rows.append(cocktail_row("Brand New", ["Tequila"]))
+
+    diff = sync_catalog(synced_engine, write_dump(tmp_path / "next", rows))
+
+    assert set(diff.inserted) == {"Brand New"}
+    assert set(diff.updated) == {"Cocktail 1"}
+    assert diff.deleted == {"Cocktail 0"}
+
+    catalog = stored_catalog(synced_engine)
+    assert len(catalog) == 10
+    assert "Cocktail 0" not in catalog
+    assert catalog["Cocktail 1"] == ("Stir.", ["lime juice", "rum"])
+    assert catalog["Brand New"] == ("Shake with ice.", ["tequila"])
+
+
+def test_second_sync_is_a_no_op(synced_engine, tmp_path):
+    rows = [cocktail_row(f"Cocktail {i}", ["Gin", "Lime Juice"]) for i in range(10)]
+    diff = sync_catalog(synced_engine, write_dump(tmp_path / "same", rows))
+
+    assert not diff
+    assert diff.catalog_size == 10
+
+
+def test_sync_records_catalog_version(synced_engine, tmp_path):
+    with Session(synced_engine) as session:
+        initial_version = get_stored_catalog_version(session)
+
+    rows = [cocktail_row(f"Cocktail {i}", ["Gin", "Lime Juice"]) for i in range(10)]
+    rows.append(cocktail_row("Brand New", ["Tequila"]))
+    diff = sync_catalog(synced_engine, write_dump(tmp_path / "next", rows))
+
+    assert diff.base_version == initial_version
+    with Session(synced_engine) as session:
+        assert get_stored_catalog_version(session) == diff.version != initial_version
+
+
+@pytest.mark.parametrize("dump_dir", ["empty", "missing"])
+def test_sync_refuses_empty_or_missing_dump(synced_engine, tmp_path, dump_dir):
+    (tmp_path / "empty").mkdir()
+
+    with pytest.raises(CatalogSyncError):
+        sync_catalog(synced_engine, tmp_path / dump_dir)
+    assert len(stored_catalog(synced_engine)) == 10
+
+
+def test_sync_refuses_mass_deletes_unless_allowed(synced_engine, tmp_path):
+    dump_dir = write_dump(tmp_path / "small", [cocktail_row("Cocktail 0", ["Gin", "Lime Juice"])])
+
+    with pytest.raises(CatalogSyncError):
+        sync_catalog(synced_engine, dump_dir)
+    assert len(stored_catalog(synced_engine)) == 10
+
+    diff = sync_catalog(synced_engine, dump_dir, allow_deletes=True)
+    assert len(diff.deleted) == 9
+    assert list(stored_catalog(synced_engine)) == ["Cocktail 0"]
+
+
+def test_sync_survives_failing_invalidation_hook(synced_engine, tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(catalog_sync, "_invalidation_hooks", [])
+    notified = []
+
+    @register_invalidation_hook
+    def failing_hook(diff):
+        raise RuntimeError("snapshot rebuild failed")
+
+    register_invalidation_hook(notified.append)
+
+    rows = [cocktail_row(f"Cocktail {i}", ["Gin", "Lime Juice"]) for i in range(10)]
+    rows.append(cocktail_row("Brand New", ["Tequila"]))
+    diff = sync_catalog(synced_engine, write_dump(tmp_path / "next", rows))
+
+    assert set(diff.inserted) == {"Brand New"}
+    assert "Brand New" in stored_catalog(synced_engine)
+    assert notified == [diff]  # Later hooks still run
+    assert "invalidation hook" in caplog.text
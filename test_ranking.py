@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+
+import pytest
+
+from ranking import RankingContext, RankingEngine, recommendation_engine, request_seed
+
+
+def make_cocktail(cocktail_id, name, ingredients, category="cocktail"):
+    return SimpleNamespace(id=cocktail_id, name=name, category=category,
+                           ingredients=[SimpleNamespace(ingredient=ingredient) for ingredient in ingredients])
+
+
+CATALOG = [make_cocktail(i, f"Cocktail {i}", ["gin", f"syrup {i % 4}"], category=f"category {i % 3}")
+           for i in range(1, 41)]
+
+
+def names(cocktails):
+    return [ranked.cocktail.name for ranked in cocktails]
+
+
+def test_top_k_orders_by_score():
+    engine = RankingEngine({"liked_ingredients": 1.0})
+    cocktails = [make_cocktail(1, "Gin Tonic", ["gin", "tonic"]),
+                 make_cocktail(2, "Gin Fizz", ["gin", "lemon juice", "soda"]),
+                 make_cocktail(3, "Mojito", ["rum", "mint"])]
+    context = RankingContext(liked_ingredients={"gin", "lemon juice"})
+
+    ranked = engine.top_k(cocktails, context, 2)
+
+    assert names(ranked) == ["Gin Fizz", "Gin Tonic"]
+    assert [item.score for item in ranked] == [1.0, 0.5]
+
+
+def test_top_k_breaks_ties_by_lower_id():
+    engine = RankingEngine({"liked_ingredients": 1.0})
+    cocktails = [make_cocktail(cocktail_id, f"Cocktail {cocktail_id}", ["gin"]) for cocktail_id in (5, 2, 9, 1)]
+    context = RankingContext(liked_ingredients={"gin"})
+
+    assert [ranked.cocktail.id for ranked in engine.top_k(cocktails, context, 3)] == [1, 2, 5]
+    assert [ranked.cocktail.id for ranked in engine.top_k(reversed(cocktails), context, 3)] == [1, 2, 5]
+
+
+def test_diversity_sampling_is_reproducible_for_a_seed():
+    context = RankingContext(liked_ingredients={"gin", "syrup 1"}, liked_categories={"category 0"})
+
+    first = recommendation_engine.top_k(CATALOG, context, 5, seed=42, pool_factor=4)
+    second = recommendation_engine.top_k(CATALOG, context, 5, seed=42, pool_factor=4)
+    assert names(first) == names(second)
+
+    samples = {tuple(names(recommendation_engine.top_k(CATALOG, context, 5, seed=seed, pool_factor=4)))
+               for seed in range(20)}
+    assert len(samples) > 1
+
+
+def test_diversity_sampling_keeps_liked_cocktails_first():
+    liked = {"Cocktail 7", "Cocktail 30"}
+    context = RankingContext(liked_cocktails=liked)
+
+    for seed in range(20):
+        ranked = recommendation_engine.top_k(CATALOG, context, 5, seed=seed, pool_factor=4)
+        assert len(ranked) == 5
+        assert set(names(ranked[:2])) == liked
+        assert len(set(names(ranked))) == 5
+
+
+def test_popularity_is_normalized_by_the_most_liked_cocktail():
+    engine = RankingEngine({"popularity": 1.0})
+    context = RankingContext(popularity={"Cocktail 1": 2, "Cocktail 2": 8}, popularity_max=8)
+
+    ranked = engine.top_k(CATALOG[:3], context, 3)
+
+    assert [(item.cocktail.name, item.score) for item in ranked] == [
+        ("Cocktail 2", 1.0), ("Cocktail 1", 0.25), ("Cocktail 3", 0.0)]
+
+
+def test_engine_rejects_unknown_features():
+    with pytest.raises(ValueError):
+        RankingEngine({"no_such_feature": 1.0})
+    with pytest.raises(ValueError):
+        RankingEngine({"popularity": 1.0}, pinned_features=("no_such_feature",))
+
+
+def test_request_seed_is_stable():
+    assert request_seed(1, ["gin"], None) == request_seed(1, ["gin"], None)
+    assert request_seed(1, ["gin"], None) != request_seed(2, ["gin"], None)
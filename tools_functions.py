@@ -1,18 +1,21 @@
 import os
-import random
 import string
+from datetime import datetime, timedelta, timezone
 
 from dotenv import load_dotenv
 from fastapi import Header, HTTPException
 from sqlalchemy import create_engine, not_, func, or_
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 
 from models_tools import *
+from ranking import (RankingContext, attach_breakdowns, build_preference_context, profile_of,
+                     recommendation_engine, request_seed, similarity_engine)
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 engine = create_engine(DATABASE_URL)
-MESSAGE_HISTORY_LIMIT = 5  # Number of user-bot message pairs to store
+MESSAGE_HISTORY_LIMIT = 5  # Number of user-bot message pairs sent to the LLM as context
+MESSAGE_RETENTION_DAYS = int(os.getenv("MESSAGE_RETENTION_DAYS", "90"))  # Age after which messages are pruned
 
 def parse_cocktail_info_request(user_id, cocktail_names: list):
     """
@@ -42,9 +45,7 @@ def parse_cocktail_recommendation_request(user_id,
         user_preferences = session.query(UserData).filter_by(user_id=user_id).first()
         preferences = user_preferences.preferences if user_preferences else {}
 
-        liked_cocktails = set(preferences.get("liked_cocktails", []))
         disliked_cocktails = set(preferences.get("disliked_cocktails", []))
-        liked_ingredients = set(preferences.get("liked_ingredients", []))
         disliked_ingredients = set(preferences.get("disliked_ingredients", []))
 
         # Exclude disliked cocktails
@@ -99,25 +100,16 @@ def parse_cocktail_recommendation_request(user_id,
                     or_(Cocktail.alcoholic == "non alcoholic", Cocktail.alcoholic == "optional alcohol")
                 )
 
-        cocktails = query.all()
-
-        # Categorize based on user preferences
-        favorite_cocktails = [c for c in cocktails if c.name in liked_cocktails]
-        cocktails_with_liked_ingredients = sorted(
-            [c for c in cocktails if c.name not in liked_cocktails],
-            key=lambda c: (
-                sum(1 for ing in c.ingredients if ing.ingredient in liked_ingredients),
-                random.random()
-            ),
-            reverse=True
-        )
+        cocktails = query.options(selectinload(Cocktail.ingredients)).all()
 
-        other_cocktails = [c for c in cocktails if c.name not in liked_cocktails and c not in cocktails_with_liked_ingredients]
-        random.shuffle(other_cocktails)
+        if limit is None:
+            return cocktails  # The full filtered set, callers rank it themselves
 
-        # Combine groups and return the top results
-        sorted_cocktails = favorite_cocktails + cocktails_with_liked_ingredients + other_cocktails
-        return sorted_cocktails[:limit]
+        # Rank by weighted preference features, seeded so the same request gets the same results
+        context = build_preference_context(session, preferences)
+        seed = request_seed(user_id, excluded_cocktail_names, ingredients, excluded_ingredients,
+                            categories, excluded_categories, alcohol_content, limit)
+        return attach_breakdowns(recommendation_engine.top_k(cocktails, context, limit, seed=seed))
 
 
 def parse_cocktail_similar_request(user_id,
@@ -129,32 +121,14 @@ def parse_cocktail_similar_request(user_id,
                                    excluded_categories=None,
                                    alcohol_content=None,
                                    limit: int = 3):
-    # Function to get all ingredients of a cocktail
-    def get_ingredients_for_cocktail(cocktail_id):
-        with Session(engine) as session:
-            return set(
-                ingredient.ingredient for ingredient in session.query(CocktailIngredient)
-                .filter(CocktailIngredient.cocktail_id == cocktail_id).all()
-            )
-
-    # Function to get the categories of a cocktail
-    def get_categories_for_cocktail(cocktail_id):
-        with Session(engine) as session:
-            return set(
-                category.category for category in session.query(Cocktail)
-                .filter(Cocktail.id == cocktail_id).all()
-            )
-
-    # Function to compute Jaccard Similarity for two sets
-    def jaccard_similarity(set1, set2):
-        intersection = len(set1.intersection(set2))
-        union = len(set1.union(set2))
-        return intersection / union if union != 0 else 0
-
+    """
+    Finds cocktails most similar to the given ones by ingredient and category Jaccard similarity.
+    """
     cocktails_like = [string.capwords(name) for name in cocktails_like]
     with Session(engine) as session:
         # Convert cocktail names to Cocktail objects
-        cocktails_like_objs = session.query(Cocktail).filter(Cocktail.name.in_(cocktails_like)).all()
+        cocktails_like_objs = (session.query(Cocktail).options(selectinload(Cocktail.ingredients))
+                               .filter(Cocktail.name.in_(cocktails_like)).all())
 
         if not cocktails_like_objs:
             return []  # If no initial cocktails are found, return an empty list
@@ -174,40 +148,17 @@ def parse_cocktail_similar_request(user_id,
             categories,
             excluded_categories,
             alcohol_content,
-            limit=None  # Get all, not just 3 random ones
+            limit=None  # Get the full filtered set, it is ranked below
         )
 
         if not filtered_cocktails:
             return []
 
-        # Get ingredients and categories for each initial cocktail
-        cocktails_like_data = []
-        for cocktail in cocktails_like_objs:
-            cocktails_like_data.append({
-                "id": cocktail.id,
-                "ingredients": get_ingredients_for_cocktail(cocktail.id),
-                "categories": get_categories_for_cocktail(cocktail.id)
-            })
-
-        # Compute similarity between remaining cocktails and cocktails_like
-        similarity_scores = []
-        for candidate in filtered_cocktails:
-            candidate_ingredients = get_ingredients_for_cocktail(candidate.id)
-            candidate_categories = get_categories_for_cocktail(candidate.id)
-
-            # Average Jaccard Similarity based on ingredients and categories
-            similarities = [
-                (jaccard_similarity(candidate_ingredients, ref["ingredients"]) +
-                 jaccard_similarity(candidate_categories, ref["categories"])) / 2
-                for ref in cocktails_like_data
-            ]
-
-            max_similarity = max(similarities) if similarities else 0
-            similarity_scores.append((candidate, max_similarity))
-
-        # Sort by descending similarity and take the top 3
-        similarity_scores.sort(key=lambda x: x[1], reverse=True)
-        return [c[0] for c in similarity_scores[:3]]
+        # Rank the remaining cocktails by similarity to the closest initial cocktail
+        context = RankingContext(reference_profiles=[profile_of(c) for c in cocktails_like_objs])
+        seed = request_seed(user_id, cocktails_like, excluded_cocktail_names, ingredients, excluded_ingredients,
+                            categories, excluded_categories, alcohol_content, limit)
+        return attach_breakdowns(similarity_engine.top_k(filtered_cocktails, context, limit or 3, seed=seed))
 
 
 def update_user_preferences(user_id, liked_cocktails=None, disliked_cocktails=None, liked_ingredients=None, disliked_ingredients=None):
@@ -256,7 +207,13 @@ def update_user_preferences(user_id, liked_cocktails=None, disliked_cocktails=No
 def get_user_id(x_user_id: str = Header(...)) -> int:
     if not x_user_id:
         raise HTTPException(status_code=400, detail="User ID is required")
-    return int(x_user_id)
+    try:
+        user_id = int(x_user_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="User ID must be a non-negative integer")
+    if user_id < 0:
+        raise HTTPException(status_code=400, detail="User ID must be a non-negative integer")
+    return user_id
 
 
 def get_user_preferences(user_id):
@@ -295,17 +252,36 @@ def clear_user_preferences(user_id):
             session.commit()
 
 
-def update_message_history(session: Session, user_id: int, user_message: str, bot_response: str):
-    user_data = session.query(UserData).filter_by(user_id=user_id).first()
-    if not user_data:
-        user_data = UserData(user_id=user_id, message_history=[])
-        session.add(user_data)
+def get_message_history(session: Session, user_id: int, limit: int = MESSAGE_HISTORY_LIMIT) -> list:
+    """
+    Returns the user's last `limit` exchanges, oldest first, via the (user_id, created_at, id) index.
+    """
+    rows = (
+        session.query(Message.user_message, Message.bot_response)
+        .filter(Message.user_id == user_id)
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(limit)
+        .all()
+    )
+    return [{"user": user_message, "bot": bot_response} for user_message, bot_response in reversed(rows)]
 
-    # Add new user message and bot response
-    user_data.message_history.append({"user": user_message, "bot": bot_response})
 
-    # Limit message history size
-    if len(user_data.message_history) > MESSAGE_HISTORY_LIMIT:
-        user_data.message_history = user_data.message_history[-MESSAGE_HISTORY_LIMIT:]
+def update_message_history(session: Session, user_id: int, user_message: str, bot_response: str):
+    # Append-only: a new row per exchange, older rows are never rewritten
+    session.add(Message(user_id=user_id, user_message=user_message, bot_response=bot_response))
+    session.commit()
+
 
+def prune_message_history(session: Session, retention_days: int = MESSAGE_RETENTION_DAYS) -> int:
+    """
+    Deletes messages older than the retention period, found through the created_at index.
+    Returns the number of deleted rows.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    deleted = (
+        session.query(Message)
+        .filter(Message.created_at < cutoff)
+        .delete(synchronize_session=False)
+    )
     session.commit()
+    return deleted